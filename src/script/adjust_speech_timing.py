@@ -7,10 +7,91 @@ Adjusts audio tempo to fit a target duration using FFmpeg's atempo filter.
 import subprocess
 import sys
 import os
+import shutil
+import json
+import math
+import hashlib
+import functools
+import tempfile
+from contextlib import redirect_stdout
 from pathlib import Path
 
-def get_audio_duration(input_file):
-    """Get the duration of an audio file using ffprobe."""
+try:
+    import av
+except ImportError:
+    av = None
+
+# 'atempo' (FFmpeg, pitch preserving) or 'resample' (in-process soxr, shifts pitch)
+TEMPO_METHOD = os.environ.get('TEMPO_METHOD', 'atempo')
+MAX_CLIPS_PER_FFMPEG = 32
+DURATION_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'audio-duration-cache')
+
+def _duration_cache_path(input_file):
+    """Sidecar cache path for an input file, keyed by its absolute path."""
+    key = hashlib.sha1(os.path.abspath(input_file).encode('utf-8')).hexdigest()
+    return os.path.join(DURATION_CACHE_DIR, f"{key}.duration")
+
+def read_cached_duration(input_file):
+    """Return the cached duration if the file is unchanged (same mtime and size)."""
+    try:
+        stat = os.stat(input_file)
+        with open(_duration_cache_path(input_file)) as f:
+            entry = json.load(f)
+        if entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return float(entry['duration'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+def write_cached_duration(input_file, duration):
+    """Persist a probed duration; failures only cost a re-probe next time."""
+    try:
+        stat = os.stat(input_file)
+        os.makedirs(DURATION_CACHE_DIR, exist_ok=True)
+        with open(_duration_cache_path(input_file), 'w') as f:
+            json.dump({
+                'mtime': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'duration': duration
+            }, f)
+    except OSError:
+        pass
+
+def parse_progress_duration(progress_output):
+    """Read the last out_time_us/out_time_ms marker from ffmpeg's -progress output."""
+    for line in reversed(progress_output.splitlines()):
+        key, _, value = line.partition('=')
+        # Both keys are reported in microseconds
+        if key in ('out_time_us', 'out_time_ms'):
+            try:
+                return int(value) / 1_000_000
+            except ValueError:
+                continue
+    return None
+
+def probe_duration_with_av(input_file):
+    """Read the container duration in-process with PyAV; None if it can't."""
+    try:
+        with av.open(input_file) as container:
+            if container.duration is not None:
+                return container.duration / av.time_base
+            stream = container.streams.audio[0]
+            if stream.duration is not None:
+                return float(stream.duration * stream.time_base)
+    except (av.error.FFmpegError, IndexError):
+        pass
+    return None
+
+def get_audio_duration(input_file, cached_duration=None):
+    """Get the duration of an audio file using PyAV, falling back to ffprobe."""
+    if cached_duration is not None:
+        return cached_duration
+
+    duration = probe_duration_with_av(input_file) if av is not None else None
+    if duration is not None:
+        write_cached_duration(input_file, duration)
+        return duration
+
     try:
         cmd = [
             'ffprobe', '-v', 'quiet', 
@@ -21,6 +102,7 @@ def get_audio_duration(input_file):
         
         result = subprocess.run(cmd, capture_output=True, text=True, check=True)
         duration = float(result.stdout.strip())
+        write_cached_duration(input_file, duration)
         return duration
         
     except subprocess.CalledProcessError as e:
@@ -30,33 +112,96 @@ def get_audio_duration(input_file):
 
 def create_tempo_filters(tempo):
     """Create atempo filter chain for large tempo adjustments."""
-    if tempo <= 2.0:
-        return [tempo]
-        
-    # Break down large tempo into multiple stages
-    filters = []
-    remaining_tempo = tempo
+    return _tempo_filters(round(tempo, 6))
+
+@functools.lru_cache(maxsize=128)
+def _tempo_filters(tempo):
+    # atempo accepts 0.5-2.0 per stage, so larger (or smaller) factors are
+    # split into n full stages plus the remaining tail, computed in closed form
+    if 0.5 <= tempo <= 2.0:
+        return (tempo,)
+
+    stage = 2.0 if tempo > 2.0 else 0.5
+    stages = math.floor(math.log(tempo, stage))
+    tail = tempo / stage ** stages
+
+    if abs(tail - 1.0) > 1e-9:
+        return (stage,) * stages + (tail,)
+    return (stage,) * stages
+
+def atempo_with_ffmpeg(input_file, output_file, tempo):
+    """Apply an atempo filter chain with FFmpeg. Returns the output duration."""
+    # Create tempo filter chain
+    tempo_filters = create_tempo_filters(tempo)
     
-    while remaining_tempo > 2.0:
-        filters.append(2.0)
-        remaining_tempo /= 2.0
-        
-    if remaining_tempo > 1.0:
-        filters.append(remaining_tempo)
-        
-    return filters
+    # Build atempo filter chain
+    atempo_chain = ','.join(f'atempo={stage:.6f}' for stage in tempo_filters)
+    print(f"Applying tempo filters: {atempo_chain}")
+    
+    # Build FFmpeg command
+    # Only genuine errors reach stderr; progress goes to stdout for the
+    # final duration, so neither pipe grows with the input length
+    cmd = [
+        'ffmpeg', '-y', '-loglevel', 'error', '-nostats',
+        '-i', input_file,
+        '-af', atempo_chain,
+        '-progress', 'pipe:1',
+        output_file
+    ]
+    
+    # Run FFmpeg
+    try:
+        result = subprocess.run(
+            cmd, 
+            stdout=subprocess.PIPE, 
+            stderr=subprocess.PIPE, 
+            text=True, 
+            check=True
+        )
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"FFmpeg error: {e.stderr}")
+
+    # Verify output duration from ffmpeg's own progress report,
+    # only falling back to ffprobe if it didn't report one
+    final_duration = parse_progress_duration(result.stdout)
+    if final_duration is None:
+        final_duration = get_audio_duration(output_file)
+    return final_duration
 
-def adjust_audio_tempo(input_file, target_duration, output_file):
+def resample_tempo(input_file, output_file, tempo):
     """
-    Adjust audio tempo to fit target duration.
+    Change tempo by resampling the decoded PCM in-process with soxr.
+    Unlike atempo this shifts pitch along with speed, so it is opt-in.
+    Returns the output duration, which is known without re-probing.
+    """
+    import soundfile as sf
+    import soxr
+
+    print(f"Resampling for tempo {tempo:.6f}")
+    audio, sample_rate = sf.read(input_file, dtype='float32')
+    # Played back at the original rate, fewer samples means a faster tempo
+    stretched = soxr.resample(audio, sample_rate, sample_rate / tempo, quality='HQ')
+    sf.write(output_file, stretched, sample_rate)
+    return len(stretched) / sample_rate
+
+def link_or_copy(input_file, output_file):
+    """Hardlink the input into place, copying only when linking isn't possible."""
+    if os.path.abspath(input_file) == os.path.abspath(output_file):
+        return
+    try:
+        if os.path.lexists(output_file):
+            os.remove(output_file)
+        os.link(input_file, output_file)
+    except OSError:
+        # Cross-device or unsupported filesystem
+        shutil.copy2(input_file, output_file)
+
+def plan_tempo_adjustment(input_file, target_duration, current_duration=None):
+    """
+    Validate a clip and work out the tempo it needs.
     
-    Args:
-        input_file: Path to input audio file
-        target_duration: Target duration in seconds
-        output_file: Path to output audio file
-        
     Returns:
-        dict: Processing information including actual tempo used
+        tuple: (clamped tempo, processing information without output details)
     """
     
     # Validate inputs
@@ -66,8 +211,9 @@ def adjust_audio_tempo(input_file, target_duration, output_file):
     if target_duration <= 0:
         raise ValueError("Target duration must be positive")
     
-    # Get current duration
-    current_duration = get_audio_duration(input_file)
+    # Get current duration (probed at most once, and not at all if passed in)
+    if current_duration is None:
+        current_duration = get_audio_duration(input_file, read_cached_duration(input_file))
     print(f"Current duration: {current_duration:.3f} seconds")
     print(f"Target duration: {target_duration:.3f} seconds")
     
@@ -81,77 +227,171 @@ def adjust_audio_tempo(input_file, target_duration, output_file):
     if clamped_tempo != required_tempo:
         print(f"Tempo clamped from {required_tempo:.3f} to {clamped_tempo:.3f}")
     
-    # Only adjust if tempo difference is significant (>5%)
-    if abs(clamped_tempo - 1.0) <= 0.05:
+    return clamped_tempo, {
+        'tempo_applied': 1.0,
+        'tempo_required': required_tempo,
+        'processed': False,
+        'current_duration': current_duration,
+        'target_duration': target_duration
+    }
+
+def needs_tempo_change(tempo):
+    """Only adjust if tempo difference is significant (>5%)"""
+    return abs(tempo - 1.0) > 0.05
+
+def record_tempo_change(info, tempo, final_duration=None):
+    """
+    Fill in processing information once a tempo change has been applied.
+    Without a measured final_duration only the expected duration is recorded.
+    """
+    info.update({
+        'tempo_applied': tempo,
+        'processed': True
+    })
+    if final_duration is None:
+        info['estimated_duration'] = info['current_duration'] / tempo
+    else:
+        info['final_duration'] = final_duration
+        info['duration_difference'] = abs(final_duration - info['target_duration'])
+    return info
+
+def adjust_audio_tempo(input_file, target_duration, output_file, current_duration=None):
+    """
+    Adjust audio tempo to fit target duration.
+    
+    Args:
+        input_file: Path to input audio file
+        target_duration: Target duration in seconds
+        output_file: Path to output audio file
+        current_duration: Input duration in seconds, if the caller already knows it
+        
+    Returns:
+        dict: Processing information including actual tempo used
+    """
+    clamped_tempo, info = plan_tempo_adjustment(input_file, target_duration, current_duration)
+    
+    if not needs_tempo_change(clamped_tempo):
         print("Tempo adjustment not needed (<5% difference)")
-        # Just copy the file
-        import shutil
-        shutil.copy2(input_file, output_file)
-        return {
-            'tempo_applied': 1.0,
-            'tempo_required': required_tempo,
-            'processed': False,
-            'current_duration': current_duration,
-            'target_duration': target_duration
-        }
+        # Just link (or copy) the file
+        link_or_copy(input_file, output_file)
+        return info
     
-    # Create tempo filter chain
-    tempo_filters = create_tempo_filters(clamped_tempo)
+    if TEMPO_METHOD == 'resample':
+        final_duration = resample_tempo(input_file, output_file, clamped_tempo)
+    else:
+        final_duration = atempo_with_ffmpeg(input_file, output_file, clamped_tempo)
+
+    print(f"Audio processing completed successfully!")
+    print(f"Output saved to: {output_file}")
+    print(f"Final duration: {final_duration:.3f} seconds")
+
+    return record_tempo_change(info, clamped_tempo, final_duration)
+
+def atempo_batch_with_ffmpeg(jobs):
+    """
+    Apply per-clip atempo chains to several clips in one FFmpeg process.
     
-    # Build atempo filter chain
-    atempo_chain = ','.join([f'atempo={tempo:.6f}' for tempo in tempo_filters])
-    print(f"Applying tempo filters: {atempo_chain}")
+    Args:
+        jobs: List of (input_file, output_file, tempo)
+    """
+    cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-nostats']
+    for input_file, _, _ in jobs:
+        cmd += ['-i', input_file]
     
-    # Build FFmpeg command
-    cmd = [
-        'ffmpeg', '-y', '-i', input_file,
-        '-af', atempo_chain,
-        output_file
-    ]
+    filter_graph = ';'.join(
+        f"[{index}:a]" + ','.join(f'atempo={stage:.6f}' for stage in create_tempo_filters(tempo)) + f"[a{index}]"
+        for index, (_, _, tempo) in enumerate(jobs)
+    )
+    cmd += ['-filter_complex', filter_graph]
+    for index, (_, output_file, _) in enumerate(jobs):
+        cmd += ['-map', f'[a{index}]', output_file]
     
-    # Run FFmpeg
+    print(f"Applying tempo filters to {len(jobs)} clips in one FFmpeg run")
     try:
-        result = subprocess.run(
+        subprocess.run(
             cmd, 
-            capture_output=True, 
+            stdout=subprocess.DEVNULL, 
+            stderr=subprocess.PIPE, 
             text=True, 
             check=True
         )
-        
-        print(f"Audio processing completed successfully!")
-        print(f"Output saved to: {output_file}")
-        
-        # Verify output duration
-        final_duration = get_audio_duration(output_file)
-        print(f"Final duration: {final_duration:.3f} seconds")
-        
-        return {
-            'tempo_applied': clamped_tempo,
-            'tempo_required': required_tempo,
-            'processed': True,
-            'current_duration': current_duration,
-            'target_duration': target_duration,
-            'final_duration': final_duration,
-            'duration_difference': abs(final_duration - target_duration)
-        }
-        
     except subprocess.CalledProcessError as e:
         raise RuntimeError(f"FFmpeg error: {e.stderr}")
 
+def adjust_audio_tempo_batch(clips):
+    """
+    Adjust the tempo of many clips, spawning one FFmpeg process per
+    MAX_CLIPS_PER_FFMPEG clips instead of one per clip.
+    
+    Args:
+        clips: Iterable of (input_file, target_duration, output_file) or
+            (input_file, target_duration, output_file, current_duration)
+        
+    Returns:
+        list: Processing information for each clip, in input order
+    """
+    results = []
+    pending = []
+    
+    for input_file, target_duration, output_file, *known in clips:
+        current_duration = known[0] if known else None
+        clamped_tempo, info = plan_tempo_adjustment(input_file, target_duration, current_duration)
+        results.append(info)
+        
+        if not needs_tempo_change(clamped_tempo):
+            link_or_copy(input_file, output_file)
+        elif TEMPO_METHOD == 'resample':
+            # Already in-process, nothing to batch
+            record_tempo_change(info, clamped_tempo, resample_tempo(input_file, output_file, clamped_tempo))
+        else:
+            pending.append((info, (input_file, output_file, clamped_tempo)))
+    
+    for start in range(0, len(pending), MAX_CLIPS_PER_FFMPEG):
+        batch = pending[start:start + MAX_CLIPS_PER_FFMPEG]
+        atempo_batch_with_ffmpeg([job for _, job in batch])
+        # FFmpeg's progress report is shared by all outputs, so each clip only
+        # gets the duration its tempo should produce, not a measured one
+        for info, (_, _, tempo) in batch:
+            record_tempo_change(info, tempo)
+    
+    return results
+
 def main():
-    if len(sys.argv) != 4:
-        print("Usage: python adjust_speech_timing.py <input_file> <target_duration> <output_file>")
+    if len(sys.argv) == 3 and sys.argv[1] == '--batch':
+        # Manifest: JSON list of {"input_file", "target_duration", "output_file"[, "current_duration"]}
+        with open(sys.argv[2]) as f:
+            manifest = json.load(f)
+        
+        try:
+            # stdout carries only the JSON results; progress goes to stderr
+            with redirect_stdout(sys.stderr):
+                results = adjust_audio_tempo_batch(
+                    (clip['input_file'], float(clip['target_duration']), clip['output_file'], clip.get('current_duration'))
+                    for clip in manifest
+                )
+            print(json.dumps(results))
+            
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        return
+    
+    if len(sys.argv) not in (4, 5):
+        print("Usage: python adjust_speech_timing.py <input_file> <target_duration> <output_file> [current_duration]")
+        print("       python adjust_speech_timing.py --batch <manifest.json>")
         print("  input_file: Path to input audio file")
         print("  target_duration: Target duration in seconds")
         print("  output_file: Path to output audio file")
+        print("  current_duration: Input duration in seconds, skips probing the input")
         sys.exit(1)
     
     input_file = sys.argv[1]
     target_duration = float(sys.argv[2])
     output_file = sys.argv[3]
+    current_duration = float(sys.argv[4]) if len(sys.argv) == 5 else None
     
     try:
-        result = adjust_audio_tempo(input_file, target_duration, output_file)
+        result = adjust_audio_tempo(input_file, target_duration, output_file, current_duration)
         print(f"Processing complete: {result}")
         
     except Exception as e:
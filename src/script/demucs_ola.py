@@ -0,0 +1,100 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from demucs.apply import apply_model
+
+def segment_weight(length):
+    """
+    Triangular overlap-add weight, as demucs.apply uses. Unlike a Hann window
+    it never reaches zero, so the first and last samples stay normalizable.
+    """
+    weight = torch.cat([
+        torch.arange(1, length // 2 + 1),
+        torch.arange(length - length // 2, 0, -1)
+    ]).float()
+    return weight / weight.max()
+
+def cpu_autocast_state():
+    """The calling thread's CPU autocast (enabled, dtype), on old and new torch"""
+    try:
+        return torch.is_autocast_enabled('cpu'), torch.get_autocast_dtype('cpu')
+    except TypeError:
+        # torch < 2.4 only has the device-specific (now deprecated) getters
+        return torch.is_autocast_cpu_enabled(), torch.get_autocast_cpu_dtype()
+
+def stream_apply_model(model, mix, segment, overlap=0.25, device='cpu', jobs=1, two_stems=None, out=None):
+    """
+    Separate a (B, C, T) mix segment by segment, overlap-adding each result
+    into one pre-allocated (B, S, C, T) CPU tensor and dropping it straight
+    away. Only `jobs` segment outputs are alive at any time, instead of every
+    segment of the track as with apply_model(split=True, num_workers=jobs).
+
+    With two_stems set to a source index, only that stem and the sum of all
+    the others are accumulated (S=2), which halves the output tensor for
+    4-stem models. `out` may be passed in to reuse an existing buffer.
+    """
+    batch, channels, length = mix.shape
+    # Concurrency only helps on CPU; GPU segments are sized as if each had the
+    # device to itself, as apply_model only used its pool on CPU too
+    if str(device) != 'cpu':
+        jobs = 1
+    # htdemucs refuses input longer than the segment it was trained on
+    segment = min(segment, getattr(model, 'max_allowed_segment', float('inf')))
+    num_stems = 2 if two_stems is not None else len(model.sources)
+    segment_length = int(segment * model.samplerate)
+    stride = int((1 - overlap) * segment_length)
+    weight = segment_weight(segment_length)
+
+    if out is None:
+        out = torch.empty(batch, num_stems, channels, length)
+    out.zero_()
+    norm = torch.zeros(length)
+
+    # Autocast is per thread: carry the caller's into the pool
+    autocast, autocast_dtype = cpu_autocast_state()
+
+    # Concurrent forwards split the caller's intra-op threads between them
+    # rather than each starting a full-size OpenMP team
+    caller_threads = torch.get_num_threads()
+    threads = max(1, caller_threads // jobs)
+
+    def separate(offset):
+        torch.set_num_threads(threads)
+        chunk = mix[..., offset:offset + segment_length]
+        # No random shifts: they pad the chunk past the model's training length.
+        # Grad mode, like autocast, is per thread, so both are set in the pool thread
+        with torch.inference_mode(), torch.autocast('cpu', dtype=autocast_dtype, enabled=autocast):
+            sources = apply_model(
+                model, chunk,
+                device=device,
+                shifts=0,
+                split=False,
+                segment=segment,
+                progress=False
+            ).cpu()
+        if two_stems is not None:
+            rest = sources.sum(1) - sources[:, two_stems]
+            sources = torch.stack([sources[:, two_stems], rest], dim=1)
+        return offset, sources
+
+    def accumulate(offset, sources):
+        chunk_length = sources.shape[-1]
+        chunk_weight = weight[:chunk_length]
+        out[..., offset:offset + chunk_length] += sources * chunk_weight
+        norm[offset:offset + chunk_length] += chunk_weight
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for offset in range(0, length, stride):
+            if len(pending) >= jobs:
+                accumulate(*pending.popleft().result())
+            pending.append(pool.submit(separate, offset))
+        while pending:
+            accumulate(*pending.popleft().result())
+
+    # set_num_threads also resizes process-wide pools; give the caller its own back
+    torch.set_num_threads(caller_threads)
+
+    out /= norm
+    return out
@@ -1,14 +1,35 @@
 import sys
-from pytubefix import YouTube
-from pytubefix.cli import on_progress
+import shutil
+from yt_dlp import YoutubeDL
 
-url = sys.argv[1]
-output_filename = sys.argv[2]
+if len(sys.argv) < 3 or len(sys.argv) % 2 == 0:
+    print("Usage: python download_audio.py <url> <output_filename> [<url> <output_filename> ...]", file=sys.stderr)
+    sys.exit(1)
 
-yt = YouTube(url)
+# Several downloads share one interpreter and yt-dlp import
+downloads = list(zip(sys.argv[1::2], sys.argv[2::2]))
 
-# Get audio stream
-audio_stream = yt.streams.filter(only_audio=True).first()
+options = {
+    # Get audio stream
+    'format': 'bestaudio[ext=m4a]/bestaudio',
+    # Fetch DASH fragments in parallel
+    'concurrent_fragment_downloads': 8,
+    # Nothing but the audio file is written
+    'writeinfojson': False,
+    'writethumbnail': False,
+    # The caller treats anything on stderr as a failure
+    'quiet': True,
+    'no_warnings': True,
+    'noprogress': True,
+}
 
-# Download as MP3
-audio_stream.download(filename=output_filename)
+# YouTube throttles each connection, so fetch segments over many of them
+if shutil.which('aria2c'):
+    options['external_downloader'] = {'default': 'aria2c'}
+    options['external_downloader_args'] = {
+        'aria2c': ['-x', '16', '-s', '16', '-k', '1M']
+    }
+
+for url, output_filename in downloads:
+    with YoutubeDL({**options, 'outtmpl': output_filename}) as ydl:
+        ydl.download([url])
@@ -1,10 +1,206 @@
 import sys
+import os
+import queue
+import threading
+from contextlib import ExitStack
+import numpy as np
+import ffmpeg
+import soundfile as sf
+import tensorflow as tf
+from spleeter.audio.adapter import AudioAdapter
 from spleeter.separator import Separator
 
+try:
+    import av
+except ImportError:
+    av = None
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+CHUNK_DURATION = 30  # Seconds of audio fed to Spleeter per call
+OVERLAP = 1  # Seconds shared by neighbouring chunks, crossfaded on write
+PREFETCH_DEPTH = 2  # Decoded chunks buffered ahead of Spleeter
+STEMS = ('vocals', 'accompaniment')
+
+def get_audio_duration(input_audio_path):
+    """Get the duration of an audio file in seconds"""
+    probe = ffmpeg.probe(input_audio_path)
+    return float(probe['format']['duration'])
+
+def configure_tensorflow_threads():
+    """Leave half the cores to the decode thread instead of letting TF take all of them"""
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(
+            max(1, (os.cpu_count() or 2) // 2)
+        )
+    except RuntimeError:
+        # Already initialized by an earlier separation in this process
+        pass
+
+def decode_chunks(container):
+    """
+    Yield (offset, waveform) for each overlapping chunk from a single
+    streaming PyAV decode, instead of reopening and seeking per chunk
+    """
+    chunk_samples = CHUNK_DURATION * SAMPLE_RATE
+    window_samples = (CHUNK_DURATION + OVERLAP) * SAMPLE_RATE
+    resampler = av.AudioResampler(format='flt', layout='stereo', rate=SAMPLE_RATE)
+
+    pending = []
+    buffered = 0
+    offset = 0
+
+    def frames():
+        for frame in container.decode(audio=0):
+            yield from resampler.resample(frame)
+        # Flush samples still held by the resampler
+        yield from resampler.resample(None)
+
+    with container:
+        for frame in frames():
+            samples = frame.to_ndarray().reshape(-1, CHANNELS)
+            pending.append(samples)
+            buffered += len(samples)
+
+            while buffered >= window_samples:
+                window = np.concatenate(pending)
+                yield offset, window[:window_samples]
+
+                # The overlap is shared with the next chunk
+                pending = [window[chunk_samples:]]
+                buffered = len(pending[0])
+                offset += CHUNK_DURATION
+
+    if buffered:
+        yield offset, np.concatenate(pending)
+
+def load_chunks(audio_adapter, input_audio_path):
+    """Yield (offset, waveform) for each overlapping chunk of the input"""
+    duration = get_audio_duration(input_audio_path)
+    chunk_index = 0
+    while chunk_index * CHUNK_DURATION < duration:
+        offset = chunk_index * CHUNK_DURATION
+        waveform, _ = audio_adapter.load(
+            input_audio_path,
+            offset=offset,
+            duration=CHUNK_DURATION + OVERLAP,
+            sample_rate=SAMPLE_RATE
+        )
+        if not len(waveform):
+            return
+
+        yield offset, waveform
+        chunk_index += 1
+
+def prefetch(iterable, depth=PREFETCH_DEPTH):
+    """Consume an iterable on a background thread, buffering up to `depth` items"""
+    buffer = queue.Queue(maxsize=depth)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                buffer.put((item, None))
+            buffer.put((done, None))
+        except Exception as e:
+            buffer.put((None, e))
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    while True:
+        item, error = buffer.get()
+        if error is not None:
+            raise error
+        if item is done:
+            return
+        yield item
+
+def iter_chunks(audio_adapter, input_audio_path):
+    """Stream chunks with PyAV, falling back to Spleeter's loader if it can't open the file"""
+    if av is not None:
+        try:
+            return decode_chunks(av.open(input_audio_path))
+        except av.error.FFmpegError as e:
+            print(f"PyAV could not open {input_audio_path}, falling back: {e}")
+
+    return load_chunks(audio_adapter, input_audio_path)
+
+def crossfade_ramps(length):
+    """Raised-cosine fade-in/fade-out weights that sum to one"""
+    fade_in = 0.5 - 0.5 * np.cos(np.linspace(0.0, np.pi, length, dtype=np.float32))
+    fade_in = fade_in[:, np.newaxis]
+    return fade_in, 1.0 - fade_in
+
+def write_chunk(writer, chunk, tail, ramps, chunk_samples):
+    """
+    Append a separated chunk to a stem file, crossfading its head with the
+    previous chunk's tail. Returns the tail to blend into the next chunk.
+    """
+    # libsndfile wraps rather than clips float samples past full scale when
+    # writing PCM_16; clipped inputs keep the crossfade blend in range too
+    np.clip(chunk, -1.0, 1.0, out=chunk)
+
+    head = 0
+    if tail is not None:
+        head = min(len(tail), len(chunk))
+        if head != len(ramps[0]):
+            ramps = crossfade_ramps(head)
+        fade_in, fade_out = ramps
+
+        # The tail is our own copy, so blend into it in place
+        blend = tail[:head]
+        blend *= fade_out
+        blend += chunk[:head] * fade_in
+        writer.write(blend)
+
+    writer.write(chunk[head:chunk_samples])
+    return chunk[chunk_samples:].copy()
+
 def separate_audio(input_audio_path, output_directory):
+    configure_tensorflow_threads()
+
     # Initialize Spleeter for 2 stems (vocals and accompaniment)
     separator = Separator('spleeter:2stems')
-    separator.separate_to_file(input_audio_path, output_directory)
+    audio_adapter = AudioAdapter.default()
+
+    # Keep Spleeter's output layout: <output_directory>/<filename>/<stem>.wav
+    filename = os.path.splitext(os.path.basename(input_audio_path))[0]
+    stem_directory = os.path.join(output_directory, filename)
+    os.makedirs(stem_directory, exist_ok=True)
+
+    chunk_samples = CHUNK_DURATION * SAMPLE_RATE
+    ramps = crossfade_ramps(OVERLAP * SAMPLE_RATE)
+
+    # Stream every chunk straight to disk; only the overlap tail of the
+    # previous chunk is kept in memory
+    with ExitStack() as stack:
+        writers = {
+            stem: stack.enter_context(sf.SoundFile(
+                os.path.join(stem_directory, f"{stem}.wav"), 'w',
+                samplerate=SAMPLE_RATE,
+                channels=CHANNELS,
+                subtype='PCM_16'
+            ))
+            for stem in STEMS
+        }
+        tails = dict.fromkeys(STEMS)
+
+        # Decode the next chunk while Spleeter works on the current one
+        for _, waveform in prefetch(iter_chunks(audio_adapter, input_audio_path)):
+            prediction = separator.separate(waveform)
+            for stem in STEMS:
+                tails[stem] = write_chunk(
+                    writers[stem],
+                    prediction[stem].astype(np.float32, copy=False),
+                    tails[stem],
+                    ramps,
+                    chunk_samples
+                )
+
+        # The last chunk's tail has no successor to blend into
+        for stem in STEMS:
+            if tails[stem] is not None:
+                writers[stem].write(tails[stem])
 
 if __name__ == "__main__":
     if len(sys.argv) != 3:
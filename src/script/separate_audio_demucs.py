@@ -1,28 +1,124 @@
 import sys
 import os
+import argparse
+import ctypes
+import functools
+import multiprocessing
+import hashlib
+import json
+import math
+import time
 import subprocess
 import psutil
 import shutil
+from concurrent.futures import ProcessPoolExecutor
+import tempfile
+import wave
 from pathlib import Path
 
+try:
+    import numpy as np
+    import torch
+except ImportError:
+    torch = None
+
+try:
+    import lameenc
+    from demucs.audio import AudioFile
+    from demucs.pretrained import get_model
+    from demucs_ola import stream_apply_model
+except ImportError:
+    # Demucs isn't importable in this interpreter; run it through its CLI instead
+    get_model = None
+
 MAX_HTDEMUCS_SEGMENT = 7.8
-DEFAULT_MODEL = "htdemucs"  # You can change this to "mdx_extra_q" if needed
+# DEMUCS_MODEL=mdx_extra_q (needs diffq) is a lighter, faster option for small hosts
+DEFAULT_MODEL = os.environ.get('DEMUCS_MODEL', "htdemucs")
+MEMORY_PER_JOB_GB = 2  # Rough extra RAM each parallel Demucs job needs
+MEMORY_PER_PROCESS_GB = 3  # Model weights plus working set of one worker process
+GPU_SEGMENT_SCALE = 4  # GPU memory, not host RAM, bounds segments on CUDA
+# Demucs always writes under <out>/<model>/; stepping back out of it puts the
+# stems straight into the Spleeter layout <out>/<track>/<stem>.mp3
+OUTPUT_FILENAME = '../{track}/{stem}.{ext}'
+
+MODEL_SAMPLE_RATE = 44100  # Every pretrained Demucs model runs at 44.1kHz stereo
+# Inputs pre-converted to 44.1k stereo WAV, kept here and reused while the
+# source is unchanged when the caller opts into caching
+INPUT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'demucs-input-cache')
+MP3_BLOCK_SECONDS = 10  # Audio encoded per lameenc call when writing stems
+# 44.1k stereo WAV inputs longer than STREAM_WINDOW_SECONDS are separated window by
+# window, so peak memory no longer grows with the length of the file
+STREAM_WINDOW_SECONDS = int(os.environ.get('DEMUCS_STREAM_WINDOW', 300))
+STREAM_OVERLAP_SECONDS = 2  # Crossfaded between neighbouring windows
+MEMORY_SNAPSHOT_TTL = 5  # Seconds a psutil memory reading is reused for
+
+MIN_SEGMENT = 2
+MAX_SEGMENT = 10
+MEMORY_BUDGET_FRACTION = 0.8  # Share of available memory a separation may use
+# Peak memory (GB) ~= alpha * segment seconds + beta. The default reproduces
+# the old 2/4/6GB brackets; measured per-model values can be supplied as
+# {"<model>": {"alpha": ..., "beta": ...}} in the DEMUCS_MEMORY_PROFILE file
+DEFAULT_MEMORY_PROFILE = (0.4, 0.0)
+MEMORY_PROFILE_PATH = os.environ.get('DEMUCS_MEMORY_PROFILE')
+
+# Memory doesn't meaningfully change during one CLI run, so decide once
+_SEGMENT_SIZE_CACHE = {}
+_MEMORY_SNAPSHOT = None
 
 def check_memory_usage():
-    """Check current memory usage"""
-    memory = psutil.virtual_memory()
-    return memory.percent, memory.available / (1024**3)  # Available GB
+    """Check current memory usage, reusing a snapshot younger than MEMORY_SNAPSHOT_TTL"""
+    global _MEMORY_SNAPSHOT
+    now = time.monotonic()
+    if _MEMORY_SNAPSHOT is None or now - _MEMORY_SNAPSHOT[0] > MEMORY_SNAPSHOT_TTL:
+        memory = psutil.virtual_memory()
+        _MEMORY_SNAPSHOT = (now, memory.percent, memory.available / (1024**3))  # Available GB
+    return _MEMORY_SNAPSHOT[1:]
+
+def check_gpu_memory():
+    """Check free CUDA memory in GB"""
+    free, total = torch.cuda.mem_get_info()
+    return free / (1024**3)
+
+def get_device():
+    """Pick the fastest available device: DEMUCS_DEVICE if set, else cuda, mps, cpu"""
+    if 'DEMUCS_DEVICE' in os.environ:
+        return os.environ['DEMUCS_DEVICE']
+
+    if torch is None:
+        return 'cpu'
+
+    if torch.cuda.is_available():
+        return 'cuda'
+    if torch.backends.mps.is_available():
+        return 'mps'
+    return 'cpu'
+
+@functools.lru_cache(maxsize=None)
+def get_memory_profile(model_name):
+    """Peak-memory coefficients (alpha, beta) for a model"""
+    if MEMORY_PROFILE_PATH:
+        try:
+            with open(MEMORY_PROFILE_PATH) as f:
+                profile = json.load(f).get(model_name)
+            if profile:
+                alpha, beta = float(profile['alpha']), float(profile['beta'])
+                # Segment size is solved as (budget - beta) / alpha
+                if not alpha > 0:
+                    raise ValueError(f"alpha for {model_name} must be positive, got {alpha}")
+                return alpha, beta
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring memory profile {MEMORY_PROFILE_PATH}: {e}")
+    return DEFAULT_MEMORY_PROFILE
 
 def get_optimal_segment_size(available_memory_gb, model_name):
-    """Determine optimal segment size based on available memory and model"""
-    if available_memory_gb >= 6:
-        size = 10
-    elif available_memory_gb >= 4:
-        size = 8
-    elif available_memory_gb >= 2:
-        size = 4
-    else:
-        size = 2
+    """Largest segment whose estimated peak memory fits the available memory budget"""
+    alpha, beta = get_memory_profile(model_name)
+    budget = available_memory_gb * MEMORY_BUDGET_FRACTION
+
+    # The estimate is linear in segment length, so solve for it directly
+    # (to 0.1s) instead of searching
+    size = math.floor((budget - beta) / alpha * 10) / 10
+    size = min(MAX_SEGMENT, max(MIN_SEGMENT, size))
 
     # If model is htdemucs, limit to 7.8
     if model_name == "htdemucs" and size > MAX_HTDEMUCS_SEGMENT:
@@ -30,89 +126,680 @@ def get_optimal_segment_size(available_memory_gb, model_name):
 
     return size
 
-def separate_audio_demucs(input_audio_path, output_directory, model=DEFAULT_MODEL):
-    """Separate audio using Demucs with memory optimization"""
+def get_segment_size(model_name, device='cpu'):
+    """Segment size for this run: DEMUCS_SEGMENT_SIZE if set, else sized from free memory"""
+    if 'DEMUCS_SEGMENT_SIZE' in os.environ:
+        return float(os.environ['DEMUCS_SEGMENT_SIZE'])
 
-    # Check memory availability
-    mem_percent, mem_available = check_memory_usage()
-    print(f"Available memory: {mem_available:.1f}GB ({100 - mem_percent:.1f}% free)")
+    if (model_name, device) not in _SEGMENT_SIZE_CACHE:
+        if device == 'cuda':
+            gpu_available = check_gpu_memory()
+            print(f"Available GPU memory: {gpu_available:.1f}GB")
+            size = get_optimal_segment_size(gpu_available, model_name) * GPU_SEGMENT_SCALE
+            # The htdemucs limit holds regardless of device
+            if model_name == "htdemucs":
+                size = min(size, MAX_HTDEMUCS_SEGMENT)
+        else:
+            mem_percent, mem_available = check_memory_usage()
+            print(f"Available memory: {mem_available:.1f}GB ({100 - mem_percent:.1f}% free)")
+            size = get_optimal_segment_size(mem_available, model_name)
+        _SEGMENT_SIZE_CACHE[(model_name, device)] = size
 
-    # Determine optimal segment
-    segment_size = get_optimal_segment_size(mem_available, model)
+    return _SEGMENT_SIZE_CACHE[(model_name, device)]
 
-    os.makedirs(output_directory, exist_ok=True)
+def physical_core_count():
+    """Physical cores, falling back to logical ones where psutil can't tell"""
+    return psutil.cpu_count(logical=False) or os.cpu_count() or 1
+
+def thread_environment():
+    """Environment for the Demucs CLI with OpenMP/MKL pools sized to physical cores"""
+    env = os.environ.copy()
+    threads = str(physical_core_count())
+    env.setdefault('OMP_NUM_THREADS', threads)
+    env.setdefault('MKL_NUM_THREADS', threads)
+    env.setdefault('MKL_DYNAMIC', 'FALSE')
+    return env
+
+def get_job_count():
+    """Parallel Demucs jobs: DEMUCS_JOBS if set, else one per spare physical core within memory limits"""
+    if 'DEMUCS_JOBS' in os.environ:
+        return int(os.environ['DEMUCS_JOBS'])
+
+    # Hyperthreads don't speed up the convolutions, and one core is left
+    # for decoding/encoding and the rest of the host
+    cores = max(1, physical_core_count() - 1)
+
+    # Each job holds its own copy of the segment buffers
+    _, mem_available = check_memory_usage()
+    return max(1, min(cores, int(mem_available // MEMORY_PER_JOB_GB)))
+
+def get_process_count(file_count):
+    """
+    Worker processes for a multi-file run: DEMUCS_PROCESSES if set, else as
+    many as there are files, pairs of physical cores and memory for a full
+    model copy each
+    """
+    if 'DEMUCS_PROCESSES' in os.environ:
+        return max(1, min(file_count, int(os.environ['DEMUCS_PROCESSES'])))
+
+    _, mem_available = check_memory_usage()
+    return max(1, min(
+        file_count,
+        physical_core_count() // 2,
+        int(mem_available // MEMORY_PER_PROCESS_GB)
+    ))
+
+class _WavePool:
+    """
+    Reusable waveform buffers, allocated in whole length buckets. Successive
+    separations in one process reuse the same large allocations instead of
+    making the allocator hand out (and the kernel reclaim) hundreds of MB per
+    file. At most max_bytes of free buffers are kept, oldest evicted first.
+    """
+
+    def __init__(self, bucket_samples, max_bytes):
+        self.bucket_samples = bucket_samples
+        self.max_bytes = max_bytes
+        self._free = []  # Oldest first
+        self._free_bytes = 0
+
+    def get(self, shape, dtype=None):
+        """Return a (possibly dirty) tensor of the given shape"""
+        dtype = dtype or torch.float32
+        *leading, length = shape
+        leading = tuple(leading)
+
+        # Smallest free buffer that is long enough, even from a larger bucket
+        fits = [
+            buffer for buffer in self._free
+            if buffer.dtype == dtype and tuple(buffer.shape[:-1]) == leading and buffer.shape[-1] >= length
+        ]
+        if fits:
+            buffer = min(fits, key=lambda buffer: buffer.shape[-1])
+            self._free.remove(buffer)
+            self._free_bytes -= buffer.numel() * buffer.element_size()
+        else:
+            bucket = -(-length // self.bucket_samples) * self.bucket_samples
+            buffer = torch.empty(*leading, bucket, dtype=dtype)
+        return buffer[..., :length]
+
+    def put(self, tensor):
+        """Hand a tensor obtained from get() back for reuse"""
+        buffer = tensor._base if tensor._base is not None else tensor
+        self._free.append(buffer)
+        self._free_bytes += buffer.numel() * buffer.element_size()
+
+        while self._free_bytes > self.max_bytes:
+            evicted = self._free.pop(0)
+            self._free_bytes -= evicted.numel() * evicted.element_size()
+
+# About one batch-of-one mix plus its stems near the streaming window limit
+_WAVE_POOL = _WavePool(bucket_samples=10 * 44100, max_bytes=512 * 1024**2)
+
+def is_model_wav(input_audio_path):
+    """Whether a file is already 16-bit 44.1k stereo PCM WAV, going by its header"""
+    try:
+        with wave.open(str(input_audio_path), 'rb') as f:
+            return (
+                f.getframerate() == MODEL_SAMPLE_RATE
+                and f.getnchannels() == 2
+                and f.getsampwidth() == 2
+            )
+    except (wave.Error, EOFError, OSError):
+        return False
+
+def normalize_input(input_audio_path, cache=False):
+    """
+    Convert an input to 44.1k stereo PCM WAV with a multithreaded ffmpeg, so
+    Demucs never resamples or downmixes it itself. Inputs already in that
+    format are used as they are. The copy keeps the original file stem, which
+    Demucs uses to name its output directory.
+
+    With cache set, the copy lives under INPUT_CACHE_DIR keyed by path, mtime
+    and size, and is shared with later runs. Otherwise it goes to a private
+    temporary directory so concurrent runs on the same source never remove
+    each other's copy. Returns (path, directory to delete afterwards or None);
+    falls back to the original file on failure.
+    """
+    if is_model_wav(input_audio_path):
+        return input_audio_path, None
+
+    created_dir = None
+    try:
+        if cache:
+            stat = os.stat(input_audio_path)
+            key = hashlib.sha1(
+                f"{os.path.abspath(input_audio_path)}:{stat.st_mtime_ns}:{stat.st_size}".encode('utf-8')
+            ).hexdigest()
+            target_dir = os.path.join(INPUT_CACHE_DIR, key)
+        else:
+            target_dir = created_dir = tempfile.mkdtemp(prefix='demucs-input-')
+
+        converted_path = os.path.join(target_dir, f"{Path(input_audio_path).stem}.wav")
+        if os.path.exists(converted_path):
+            return converted_path, None
+
+        os.makedirs(target_dir, exist_ok=True)
+        partial_path = f"{converted_path}.partial"
+        subprocess.run([
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-i', input_audio_path,
+            '-ac', '2',
+            '-ar', str(MODEL_SAMPLE_RATE),
+            '-c:a', 'pcm_s16le',
+            '-threads', str(physical_core_count()),
+            '-f', 'wav', partial_path
+        ], capture_output=True, text=True, check=True)
+        # Publish atomically so a concurrent run never reads a half-written file
+        os.replace(partial_path, converted_path)
+        return converted_path, created_dir
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Could not pre-convert {input_audio_path}, passing it through: {e}")
+        if created_dir is not None:
+            shutil.rmtree(created_dir, ignore_errors=True)
+        return input_audio_path, None
+
+def open_sequential(path):
+    """Open a file for one front-to-back read, asking the kernel for full readahead"""
+    f = open(path, 'rb')
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    return f
+
+def release_page_cache(f):
+    """
+    Flush a finished output and drop it from the page cache; nothing here
+    reads it again, and on small hosts the next file needs the memory more
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    f.flush()
+    # Dirty pages can't be dropped, so write them back first
+    os.fdatasync(f.fileno())
+    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+def pcm_to_tensor(frames, channels):
+    """16-bit interleaved PCM bytes to a (channels, samples) float tensor"""
+    pcm = np.frombuffer(frames, dtype='<i2').reshape(-1, channels)
+    return torch.from_numpy(pcm.T / np.float32(2**15))
+
+def read_wav(input_audio_path):
+    """Read a 16-bit PCM WAV into a (channels, samples) float tensor without spawning ffmpeg"""
+    with open_sequential(input_audio_path) as raw, wave.open(raw, 'rb') as f:
+        return pcm_to_tensor(f.readframes(f.getnframes()), f.getnchannels())
+
+def wav_frame_count(input_audio_path):
+    """Number of samples per channel in a WAV, read from its header"""
+    with wave.open(input_audio_path, 'rb') as f:
+        return f.getnframes()
+
+def iter_wav_windows(input_audio_path, window, stride):
+    """
+    Yield (channels, <=window) blocks of a WAV starting every `stride`
+    samples, reading only the new part of each block from disk
+    """
+    with open_sequential(input_audio_path) as raw, wave.open(raw, 'rb') as f:
+        channels = f.getnchannels()
+        block = pcm_to_tensor(f.readframes(window), channels)
+        while True:
+            yield block
+            if block.shape[-1] < window:
+                return
+            more = pcm_to_tensor(f.readframes(stride), channels)
+            if not more.shape[-1]:
+                return
+            block = torch.cat([block[:, stride:], more], dim=1)
+
+def wav_statistics(input_audio_path, block_samples=MP3_BLOCK_SECONDS * MODEL_SAMPLE_RATE):
+    """Mean and std of the mono mix, as load_track computes them, in one streaming pass"""
+    count, total, total_squares = 0, 0.0, 0.0
+    for block in iter_wav_windows(input_audio_path, block_samples, block_samples):
+        ref = block.mean(0, dtype=torch.float64)
+        count += ref.numel()
+        total += ref.sum().item()
+        total_squares += ref.square().sum().item()
+
+    mean = total / count
+    std = math.sqrt(max(total_squares - count * mean * mean, 0.0) / max(count - 1, 1))
+    return torch.tensor(mean), torch.tensor(std)
+
+def lock_parameters(demucs_model):
+    """
+    Best-effort mlock of the model weights so memory pressure between
+    separations doesn't evict them and make the next call fault them back in.
+    Needs CAP_IPC_LOCK or a large enough RLIMIT_MEMLOCK; otherwise a no-op.
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        for parameter in demucs_model.parameters():
+            size = parameter.numel() * parameter.element_size()
+            if libc.mlock(ctypes.c_void_p(parameter.data_ptr()), ctypes.c_size_t(size)) != 0:
+                print(f"Could not lock model weights in memory: {os.strerror(ctypes.get_errno())}")
+                return
+    except (OSError, AttributeError) as e:
+        print(f"Could not lock model weights in memory: {e}")
+
+@functools.lru_cache(maxsize=2)
+def load_model(model_name, device, quantize=None):
+    """
+    Load a pretrained Demucs model once and keep it resident for later calls.
+    Two slots let a caller alternating models (or quantization) in a loop
+    keep both loaded.
+    """
+    demucs_model = get_model(model_name)
+    demucs_model.to(device)
+    demucs_model.eval()
+
+    if quantize == 'int8' and device == 'cpu':
+        # Dynamic quantization only covers Linear layers (the transformer in
+        # htdemucs); convolutions stay in float32
+        demucs_model = torch.ao.quantization.quantize_dynamic(
+            demucs_model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+
+    if device == 'cpu':
+        lock_parameters(demucs_model)
+
+    return demucs_model
+
+def load_track(demucs_model, input_audio_path):
+    """Decode a file at the model's rate and normalize it the way demucs.separate does"""
+    if is_model_wav(input_audio_path):
+        # Already at the model's rate and channel count
+        wav = read_wav(input_audio_path)
+    else:
+        wav = AudioFile(input_audio_path).read(
+            streams=0,
+            samplerate=demucs_model.samplerate,
+            channels=demucs_model.audio_channels
+        )
+
+    ref = wav.mean(0)
+    mean, std = ref.mean(), ref.std()
+    return (wav - mean) / std, mean, std
+
+def mp3_encoder(samplerate, channels, bitrate=320):
+    """A lameenc encoder configured the way demucs.separate --mp3 encodes"""
+    encoder = lameenc.Encoder()
+    encoder.set_bit_rate(bitrate)
+    encoder.set_in_sample_rate(samplerate)
+    encoder.set_channels(channels)
+    encoder.set_quality(2)  # 2-highest, 7-fastest
+    encoder.silence()
+    return encoder
 
+def encode_block(encoder, block, scale=1):
+    """Encode a (channels, samples) float block, clipped to [-1, 1] after scaling"""
+    block = block.cpu() / scale
+    pcm = (block.clamp_(-1, 1) * (2**15 - 1)).short()
+    return encoder.encode(pcm.t().contiguous().numpy().tobytes())
+
+def write_mp3(wav, path, samplerate, bitrate=320):
+    """
+    Encode a (channels, samples) float waveform to MP3 with lameenc, block by
+    block, so no full-length clipped or int16 copy of the stem is materialized
+    """
+    encoder = mp3_encoder(samplerate, wav.shape[0], bitrate)
+
+    # Same 'rescale' clipping demucs applies, found without an abs() copy
+    peak = max(wav.max().item(), -wav.min().item())
+    scale = max(1.01 * peak, 1)
+
+    block_samples = MP3_BLOCK_SECONDS * samplerate
+    # Encode under a temporary name so an interrupted run never leaves a
+    # truncated stem that has_stems would take as finished
+    partial_path = f"{path}.partial"
+    with open(partial_path, 'wb') as f:
+        for start in range(0, wav.shape[-1], block_samples):
+            f.write(encode_block(encoder, wav[:, start:start + block_samples], scale))
+        f.write(encoder.flush())
+        release_page_cache(f)
+    os.replace(partial_path, path)
+
+def write_stems(demucs_model, stems, input_audio_path, output_directory):
+    """Write Spleeter-style vocals/accompaniment from one track's (2, C, T) stems"""
+    vocals, accompaniment = stems
+
+    target_dir = Path(output_directory) / Path(input_audio_path).stem
+    target_dir.mkdir(parents=True, exist_ok=True)
+
+    for name, stem in (('vocals', vocals), ('accompaniment', accompaniment)):
+        stem_path = target_dir / f"{name}.mp3"
+        write_mp3(stem, stem_path, demucs_model.samplerate)
+        print(f"{name.capitalize()} saved to: {stem_path}")
+
+def separate_batch(demucs_model, input_audio_paths, output_directory, device, segment_size, jobs, quantize=None):
+    """Separate several files with one streaming pass over a right-padded (B, C, T) batch"""
+    tracks = [load_track(demucs_model, path) for path in input_audio_paths]
+    length = max(wav.shape[-1] for wav, _, _ in tracks)
+    channels = tracks[0][0].shape[0]
+
+    # Stage the right-padded batch in a reused buffer
+    mix = _WAVE_POOL.get((len(tracks), channels, length))
+    for index, (wav, _, _) in enumerate(tracks):
+        mix[index, :, :wav.shape[-1]] = wav
+        mix[index, :, wav.shape[-1]:] = 0
+
+    # Only vocals and the sum of the other stems are kept, as --two-stems vocals does
+    stems = _WAVE_POOL.get((len(tracks), 2, channels, length))
+    # bf16 autocast runs the convolutions on AVX512-BF16/AMX where available
+    with torch.autocast('cpu', dtype=torch.bfloat16, enabled=quantize == 'bf16' and device == 'cpu'):
+        stream_apply_model(
+            demucs_model, mix,
+            segment=segment_size,
+            overlap=0.25,
+            device=device,
+            jobs=jobs,
+            two_stems=demucs_model.sources.index('vocals'),
+            out=stems
+        )
+
+    _WAVE_POOL.put(mix)
+
+    for input_audio_path, (wav, mean, std), track_stems in zip(input_audio_paths, tracks, stems):
+        # De-normalize in place rather than into a fresh copy of every stem
+        track_stems = track_stems[..., :wav.shape[-1]]
+        track_stems.mul_(std).add_(mean)
+        write_stems(demucs_model, track_stems, input_audio_path, output_directory)
+
+    _WAVE_POOL.put(stems)
+
+def separate_streaming(demucs_model, input_audio_path, output_directory, device, segment_size, jobs, quantize=None):
+    """
+    Separate a long cached WAV window by window, crossfading neighbouring
+    windows and encoding finished audio straight to MP3. Memory is bounded by
+    the window length instead of the file length. Stems are clipped rather
+    than rescaled, since the peak of the whole stem is never known up front.
+    """
+    samplerate = demucs_model.samplerate
+    window = STREAM_WINDOW_SECONDS * samplerate
+    overlap = STREAM_OVERLAP_SECONDS * samplerate
+    fade_in = torch.linspace(0, 1, overlap)
+    fade_out = 1 - fade_in
+    vocals_index = demucs_model.sources.index('vocals')
+
+    # The whole-track normalization demucs.separate uses, without loading the track
+    mean, std = wav_statistics(input_audio_path)
+
+    target_dir = Path(output_directory) / Path(input_audio_path).stem
+    target_dir.mkdir(parents=True, exist_ok=True)
+    stem_paths = [target_dir / f"{name}.mp3" for name in ('vocals', 'accompaniment')]
+
+    # Published under their final names only once fully encoded, as in write_mp3
+    partial_paths = [f"{stem_path}.partial" for stem_path in stem_paths]
+
+    with open(partial_paths[0], 'wb') as vocals_file, open(partial_paths[1], 'wb') as accompaniment_file:
+        outputs = [
+            (vocals_file, mp3_encoder(samplerate, demucs_model.audio_channels)),
+            (accompaniment_file, mp3_encoder(samplerate, demucs_model.audio_channels))
+        ]
+        tail = None
+
+        for block in iter_wav_windows(input_audio_path, window + overlap, window):
+            mix = ((block - mean) / std).unsqueeze(0)
+            with torch.autocast('cpu', dtype=torch.bfloat16, enabled=quantize == 'bf16' and device == 'cpu'):
+                stems = stream_apply_model(
+                    demucs_model, mix,
+                    segment=segment_size,
+                    overlap=0.25,
+                    device=device,
+                    jobs=jobs,
+                    two_stems=vocals_index
+                )[0]
+            stems.mul_(std).add_(mean)
+
+            if tail is not None:
+                # Crossfade this window's head with the previous window's tail
+                head = min(tail.shape[-1], stems.shape[-1])
+                stems[..., :head] *= fade_in[:head]
+                stems[..., :head] += tail[..., :head] * fade_out[:head]
+
+            # Hold the overlap back; the next window blends into it
+            tail = stems[..., window:].clone()
+            for (f, encoder), stem in zip(outputs, stems[..., :window]):
+                f.write(encode_block(encoder, stem))
+
+        # The last window's tail has no successor to blend into
+        for (f, encoder), stem in zip(outputs, tail):
+            f.write(encode_block(encoder, stem))
+            f.write(encoder.flush())
+            release_page_cache(f)
+
+    for name, partial_path, stem_path in zip(('vocals', 'accompaniment'), partial_paths, stem_paths):
+        os.replace(partial_path, stem_path)
+        print(f"{name.capitalize()} saved to: {stem_path}")
+
+def separate_in_process(input_audio_paths, output_directory, model, device, segment_size, jobs, batch_size=1, quantize=None, threads=None):
+    """Separate files with the Demucs Python API, reusing one loaded model"""
+    # Default pools size to logical cores, which thrash on hyperthreaded VPSes
+    torch.set_num_threads(threads or physical_core_count())
+
+    try:
+        demucs_model = load_model(model, device, quantize)
+
+        # Long files go through the bounded-memory path one at a time
+        stream_limit = STREAM_WINDOW_SECONDS * demucs_model.samplerate
+        long_paths = [
+            path for path in input_audio_paths
+            if is_model_wav(path) and wav_frame_count(path) > stream_limit
+        ]
+        for input_audio_path in long_paths:
+            separate_streaming(demucs_model, input_audio_path, output_directory, device, segment_size, jobs, quantize)
+
+        input_audio_paths = [path for path in input_audio_paths if path not in long_paths]
+        for start in range(0, len(input_audio_paths), batch_size):
+            separate_batch(
+                demucs_model,
+                input_audio_paths[start:start + batch_size],
+                output_directory,
+                device,
+                segment_size,
+                jobs,
+                quantize
+            )
+        print("Demucs processing completed successfully")
+        return True
+    except Exception as e:
+        print(f"Demucs processing failed: {e}")
+        return False
+
+def separate_in_processes(input_audio_paths, output_directory, model, device, segment_size, jobs, processes, batch_size=1, quantize=None):
+    """
+    Spread independent files over worker processes, each loading the model
+    once and getting an equal share of the physical cores. Uses `processes`
+    times the memory of a single run, which get_process_count budgets for.
+    """
+    threads = max(1, physical_core_count() // processes)
+    # Every worker holds its own segment buffers, so size them for its share of RAM
+    _, mem_available = check_memory_usage()
+    segment_size = min(segment_size, get_optimal_segment_size(mem_available / processes, model))
+    worker_jobs = max(1, jobs // processes)
+    # Round-robin so long and short files are mixed across workers
+    groups = [input_audio_paths[index::processes] for index in range(processes)]
+
+    print(f"Separating in {processes} processes with {threads} threads each")
+
+    # Forked children inherit torch's thread pools mid-state; spawn fresh ones
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+        results = pool.map(
+            separate_in_process,
+            groups,
+            [output_directory] * processes,
+            [model] * processes,
+            [device] * processes,
+            [segment_size] * processes,
+            [worker_jobs] * processes,
+            [batch_size] * processes,
+            [quantize] * processes,
+            [threads] * processes
+        )
+        return all(results)
+
+def separate_with_cli(input_audio_paths, output_directory, model, device, segment_size, jobs):
+    """Separate files by running demucs.separate in a subprocess"""
+    # A single Demucs run loads the model once and iterates over every input
     cmd = [
         'python', '-m', 'demucs.separate',
-        '--device', 'cpu',
-        '--segment', str(segment_size),
+        '--device', device,
+        # The CLI only accepts whole seconds
+        '--segment', str(int(segment_size)),
+        '-j', str(jobs),
         '--two-stems', 'vocals',
         '--mp3',
         '--mp3-bitrate', '320',
         '-n', model,
         '--out', output_directory,
-        input_audio_path
+        '--filename', OUTPUT_FILENAME,
+        *input_audio_paths
     ]
 
-    print(f"Running Demucs with segment size: {segment_size}")
     print(f"Command: {' '.join(cmd)}")
 
-    try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        print("Demucs processing completed successfully")
-        print("STDOUT:", result.stdout)
-        reorganize_output(input_audio_path, output_directory, model)
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"Demucs processing failed: {e}")
-        print("STDERR:", e.stderr)
-        print("STDOUT:", e.stdout)
+    # Forward Demucs' output as it arrives instead of buffering it all
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        bufsize=65536,
+        text=True,
+        env=thread_environment()
+    )
+    with process:
+        for line in process.stdout:
+            print(line, end='')
+
+    if process.returncode != 0:
+        print(f"Demucs processing failed with exit code {process.returncode}")
         return False
 
-def reorganize_output(input_audio_path, output_directory, model_name):
-    """Reorganize Demucs output to match Spleeter structure"""
-    input_filename = Path(input_audio_path).stem
-    demucs_output_dir = os.path.join(output_directory, model_name, input_filename)
+    print("Demucs processing completed successfully")
+    for input_audio_path in input_audio_paths:
+        reorganize_output(input_audio_path, output_directory)
+    cleanup_model_directory(output_directory, model)
+    return True
 
-    if os.path.exists(demucs_output_dir):
-        target_dir = os.path.join(output_directory, input_filename)
-        os.makedirs(target_dir, exist_ok=True)
+def has_stems(input_audio_path, output_directory):
+    """Whether both Spleeter-style stems for this input are already on disk"""
+    target_dir = Path(output_directory) / Path(input_audio_path).stem
+    return all((target_dir / f"{name}.mp3").exists() for name in ('vocals', 'accompaniment'))
 
-        vocals_src = os.path.join(demucs_output_dir, 'vocals.mp3')
-        accompaniment_src = os.path.join(demucs_output_dir, 'no_vocals.mp3')
+def separate_audio_demucs(input_audio_paths, output_directory, model=DEFAULT_MODEL, batch_size=1, quantize=None, force=False, cache_inputs=False):
+    """
+    Separate one or more audio files using Demucs with memory optimization.
+    Up to batch_size files (padded to the longest) share one forward pass;
+    every extra file in a batch adds its full length to peak memory.
+    quantize ('int8' or 'bf16') trades some quality for faster CPU inference.
+    Files whose stems already exist are skipped unless force is set.
+    Converted copies of the inputs are deleted afterwards unless cache_inputs
+    is set, which only pays off when the same files are separated again.
+    """
+    if isinstance(input_audio_paths, (str, os.PathLike)):
+        input_audio_paths = [input_audio_paths]
+    input_audio_paths = list(input_audio_paths)
 
-        vocals_dst = os.path.join(target_dir, 'vocals.mp3')
-        accompaniment_dst = os.path.join(target_dir, 'accompaniment.mp3')
+    if not force:
+        # Retries and re-processed batches shouldn't pay for finished files again
+        pending = []
+        for input_audio_path in input_audio_paths:
+            if has_stems(input_audio_path, output_directory):
+                print(f"Stems already exist, skipping: {input_audio_path}")
+            else:
+                pending.append(input_audio_path)
+        input_audio_paths = pending
+        if not input_audio_paths:
+            return True
 
-        if os.path.exists(vocals_src):
-            shutil.move(vocals_src, vocals_dst)
-            print(f"Vocals saved to: {vocals_dst}")
+    # Determine device, optimal segment and parallelism once for the whole batch
+    device = get_device()
+    segment_size = get_segment_size(model, device)
+    jobs = get_job_count()
 
-        if os.path.exists(accompaniment_src):
+    os.makedirs(output_directory, exist_ok=True)
+
+    # Stems are named after the file stem, which the converted copy keeps
+    normalized = [normalize_input(path, cache_inputs) for path in input_audio_paths]
+    input_audio_paths = [path for path, _ in normalized]
+    # Only the private copies made by this call are ever deleted
+    created_dirs = [created_dir for _, created_dir in normalized if created_dir is not None]
+
+    print(f"Running Demucs on {len(input_audio_paths)} file(s) on {device} with segment size: {segment_size}, jobs: {jobs}")
+
+    try:
+        # In-process avoids a second interpreter plus torch import per run
+        if get_model is not None:
+            processes = get_process_count(len(input_audio_paths)) if device == 'cpu' else 1
+            if processes > 1:
+                return separate_in_processes(input_audio_paths, output_directory, model, device, segment_size, jobs, processes, batch_size, quantize)
+            return separate_in_process(input_audio_paths, output_directory, model, device, segment_size, jobs, batch_size, quantize)
+        # A persistent worker would only save start-up if something outlived
+        # this process; callers exec the script once per request, and an
+        # interpreter that can't import Demucs couldn't host one either
+        return separate_with_cli(input_audio_paths, output_directory, model, device, segment_size, jobs)
+    finally:
+        # Callers usually pass a fresh file per request, so a kept copy would never be hit
+        for created_dir in created_dirs:
+            shutil.rmtree(created_dir, ignore_errors=True)
+
+def reorganize_output(input_audio_path, output_directory):
+    """Rename Demucs' no_vocals stem to the Spleeter accompaniment name"""
+    target_dir = Path(output_directory) / Path(input_audio_path).stem
+    # One directory scan instead of a stat per candidate file
+    files = {p.name: p for p in target_dir.iterdir()} if target_dir.is_dir() else {}
+    accompaniment_src = files.get('no_vocals.mp3')
+    accompaniment_dst = target_dir / 'accompaniment.mp3'
+
+    if accompaniment_src is not None:
+        try:
+            # Same directory, so this is a single atomic rename
+            os.replace(accompaniment_src, accompaniment_dst)
+        except OSError:
             shutil.move(accompaniment_src, accompaniment_dst)
-            print(f"Accompaniment saved to: {accompaniment_dst}")
+        print(f"Accompaniment saved to: {accompaniment_dst}")
 
+    # Demucs' encoder left both stems in the page cache
+    for stem_path in (target_dir / 'vocals.mp3', accompaniment_dst):
         try:
-            shutil.rmtree(os.path.join(output_directory, model_name))
-        except:
+            with open(stem_path, 'rb') as f:
+                release_page_cache(f)
+        except OSError:
             pass
 
-def main():
-    if len(sys.argv) != 3:
-        print("Usage: python separate_audio_demucs.py <input_audio_path> <output_directory>")
-        sys.exit(1)
+def cleanup_model_directory(output_directory, model_name):
+    """Remove the per-model directory Demucs creates, which stays empty"""
+    try:
+        (Path(output_directory) / model_name).rmdir()
+    except OSError:
+        pass
 
-    input_audio_path = sys.argv[1]
-    output_directory = sys.argv[2]
+def main():
+    parser = argparse.ArgumentParser(description="Separate vocals and accompaniment using Demucs")
+    parser.add_argument('input_audio_paths', nargs='+', help="One or more input audio files")
+    parser.add_argument('output_directory', help="Directory receiving <name>/vocals.mp3 and <name>/accompaniment.mp3")
+    parser.add_argument('--model', default=DEFAULT_MODEL, help="Pretrained Demucs model name")
+    parser.add_argument('--batch-size', type=int, default=1, help="Files separated together in one forward pass")
+    parser.add_argument('--quantize', choices=['int8', 'bf16'], help="Reduced-precision CPU inference")
+    parser.add_argument('--force', action='store_true', help="Separate again even if the stems already exist")
+    parser.add_argument('--cache-inputs', action='store_true', help="Keep converted inputs for later runs on the same files")
+    args = parser.parse_args()
 
-    if not os.path.exists(input_audio_path):
-        print(f"Error: Input file not found: {input_audio_path}")
-        sys.exit(1)
+    for input_audio_path in args.input_audio_paths:
+        if not os.path.exists(input_audio_path):
+            print(f"Error: Input file not found: {input_audio_path}")
+            sys.exit(1)
 
-    print(f"Processing: {input_audio_path}")
-    print(f"Output directory: {output_directory}")
+    print(f"Processing: {', '.join(args.input_audio_paths)}")
+    print(f"Output directory: {args.output_directory}")
 
-    success = separate_audio_demucs(input_audio_path, output_directory)
+    success = separate_audio_demucs(
+        args.input_audio_paths,
+        args.output_directory,
+        model=args.model,
+        batch_size=args.batch_size,
+        quantize=args.quantize,
+        force=args.force,
+        cache_inputs=args.cache_inputs
+    )
 
     if success:
         print("Audio separation completed successfully!")
@@ -152,7 +152,7 @@ export class AudioCombiner {
 
           // Call Python script to adjust timing
           const { stdout, stderr } = await execAsync(
-            `python "${scriptPath}" "${segment.path}" ${targetDurationSec} "${adjustedPath}"`
+            `python "${scriptPath}" "${segment.path}" ${targetDurationSec} "${adjustedPath}" ${actualDuration}`
           );
 
           if (stderr && !stderr.includes("Defaulting")) {